@@ -1,21 +1,21 @@
 import sys
 import shutil
-from time import sleep
-import numpy as np
+from time import sleep, time
 from glob import glob
 import signal
 import re
 import os
-from datetime import datetime
+from functools import lru_cache
 import argparse
 from collections import defaultdict, Counter
-from statistics import mean
 from transition_amr_parser.io import read_config_variables
 from transition_amr_parser.clbar import clbar, yellow_font
-from fairseq_ext.utils import (
-    remove_optimizer_state, load_checkpoint_ext
-)
-from ipdb import set_trace
+try:
+    # optional, wait for checkpoints with file events instead of polling
+    import inotify_simple
+    has_inotify = True
+except ImportError:
+    has_inotify = False
 
 
 # Sanity check python3
@@ -26,7 +26,27 @@ if int(sys.version[0]) < 3:
 
 # results file content regex
 smatch_results_re = re.compile(r'^F-score: ([0-9\.]+)')
-checkpoint_re = re.compile(r'.*checkpoint([0-9]+)\.pt$')
+seed_re = re.compile(r'.*seed([0-9]+)')
+# bash color escape codes
+bash_scape_re = re.compile(r'\x1b\[\d+m|\x1b\[0m')
+
+# terminal width, updated on SIGWINCH (see main)
+terminal_ncol = shutil.get_terminal_size((80, 20)).columns
+
+
+@lru_cache(maxsize=4096)
+def read_config_variables_by_mtime(config_path, mtime_ns):
+    # mtime_ns is only used as part of the cache key
+    return read_config_variables(config_path)
+
+
+def read_config(config_path):
+    """
+    Cached read_config_variables, invalidated if the config file changes.
+    Returns a copy, since callers may add keys to it
+    """
+    mtime_ns = os.stat(config_path).st_mtime_ns
+    return dict(read_config_variables_by_mtime(config_path, mtime_ns))
 
 
 def argument_parser():
@@ -122,8 +142,9 @@ def argument_parser():
     )
     parser.add_argument(
         "--wait-checkpoint-ready-to-eval",
-        help="Wait 10 seconds to check if there is a checkpoint pending to "
-             "eval, return path if it exists.",
+        help="Wait for a checkpoint pending to eval, return path if it "
+             "exists. Checks every 10 seconds, and also on checkpoint or "
+             "result write if inotify_simple is installed",
         action='store_true'
     )
     parser.add_argument(
@@ -140,46 +161,138 @@ def argument_parser():
     return args
 
 
+def get_checkpoint_epoch(checkpoint):
+    """
+    Epoch of a path or name like checkpoint42.pt, None for other files
+    """
+    name = checkpoint.rsplit('/', 1)[-1]
+    if not (name.startswith('checkpoint') and name.endswith('.pt')):
+        return None
+    epoch = name[10:-3]
+    # isdigit() alone would accept e.g. superscripts int() rejects
+    if epoch.isascii() and epoch.isdigit():
+        return int(epoch)
+    return None
+
+
+def get_result_epoch(result, eval_metric):
+    """
+    Epoch of a path or name like dec-checkpoint42.{eval_metric}, None for
+    other files
+    """
+    name = result.rsplit('/', 1)[-1]
+    suffix = f'.{eval_metric}'
+    if not (
+        name.startswith(('dec-checkpoint', 'dev-checkpoint'))
+        and name.endswith(suffix)
+    ):
+        return None
+    epoch = name[14:-len(suffix)]
+    if epoch.isascii() and epoch.isdigit():
+        return int(epoch)
+    return None
+
+
+def iter_entries(folder):
+    # os.scandir, but nothing if the folder does not exist (yet)
+    try:
+        entries = os.scandir(folder)
+    except FileNotFoundError:
+        return
+    with entries:
+        yield from entries
+
+
+def get_folder_version(folder):
+    """
+    Modification time of folder, used to key caches of its listing. None if
+    the folder does not exist or changed too recently to trust the time stamp
+    """
+    try:
+        mtime_ns = os.stat(folder).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if time() * 1e9 - mtime_ns < 2e9:
+        # file systems with coarse time stamps may not show further changes
+        return None
+    return mtime_ns
+
+
+@lru_cache(maxsize=4096)
+def list_folder_by_version(folder, version):
+    # version is only used as part of the cache key
+    return tuple(entry.name for entry in iter_entries(folder))
+
+
+def list_folder(folder):
+    """
+    Names of the entries in folder, cached until the folder changes. Only the
+    listing is cached, file contents may change without changing the folder
+    """
+    version = get_folder_version(folder)
+    if version is None:
+        return list_folder_by_version.__wrapped__(folder, version)
+    return list_folder_by_version(folder, version)
+
+
+def get_checkpoint_epochs(seed_folder):
+    """
+    Epochs of all checkpoint{epoch}.pt in seed_folder
+    """
+    epochs = set()
+    for name in list_folder(seed_folder):
+        epoch = get_checkpoint_epoch(name)
+        if epoch is not None:
+            epochs.add(epoch)
+    return epochs
+
+
+def iter_checkpoints(seed_folder):
+    """
+    Yield (os.DirEntry, epoch) for every checkpoint{epoch}.pt in seed_folder
+    """
+    for entry in iter_entries(seed_folder):
+        epoch = get_checkpoint_epoch(entry.name)
+        if epoch is not None:
+            yield entry, epoch
+
+
 def check_model_training(seed_folder, max_epoch, is_done):
 
     diplay_lines = []
-    final_checkpoint = f'{seed_folder}/checkpoint{max_epoch}.pt'
-    if os.path.isfile(final_checkpoint) or is_done:
+    if is_done:
+        curr_epoch = max_epoch
+    else:
+        # Get which epochs are completed
+        curr_epoch = max(get_checkpoint_epochs(seed_folder), default=0)
+
+    if curr_epoch >= max_epoch:
         # Last epoch completed
         diplay_lines.append(
             (f"\033[92m{max_epoch}/{max_epoch}\033[0m", f"{seed_folder}")
         )
+    elif curr_epoch:
+        diplay_lines.append(
+            (f"\033[93m{curr_epoch}/{max_epoch}\033[0m", f"{seed_folder}")
+        )
     else:
-        # Get which epochs are completed
-        epochs = []
-        for checkpoint in glob(f'{seed_folder}/checkpoint*.pt'):
-            fetch = checkpoint_re.match(checkpoint)
-            if fetch:
-                epochs.append(int(fetch.groups()[0]))
-        if epochs:
-            curr_epoch = max(epochs)
-            diplay_lines.append(
-                (f"\033[93m{curr_epoch}/{max_epoch}\033[0m", f"{seed_folder}")
-            )
-        else:
-            curr_epoch = 0
-            diplay_lines.append(
-                (f"{curr_epoch}/{max_epoch}", f"{seed_folder}")
-            )
+        diplay_lines.append(
+            (f"{curr_epoch}/{max_epoch}", f"{seed_folder}")
+        )
 
     return diplay_lines
 
 
 def read_results(seed_folder, eval_metric, target_epochs, warnings=True):
 
-    val_result_re = re.compile(r'.*de[cv]-checkpoint([0-9]+)\.' + eval_metric)
     validation_folder = f'{seed_folder}/epoch_tests/'
     epochs = []
     faulty_scores = []
-    for result in glob(f'{validation_folder}/*.{eval_metric}'):
-        fetch = val_result_re.match(result)
-        if fetch:
-            epochs.append(int(fetch.groups()[0]))
+    for name in list_folder(validation_folder):
+        epoch = get_result_epoch(name, eval_metric)
+        if epoch is not None:
+            epochs.append(epoch)
+            result = os.path.join(validation_folder, name)
             if os.stat(result).st_size == 0:
                 faulty_scores.append(result)
     missing_epochs = set(target_epochs) - set(epochs)
@@ -214,13 +327,17 @@ def get_checkpoints_to_eval(config_env_vars, seed, ready=False, warnings=True):
         seed_folder, eval_metric, target_epochs, warnings=warnings
     )
 
-    # construct paths
+    # construct paths, resolve the seed folder only once
+    resolved_seed_folder = os.path.realpath(seed_folder)
+    if ready:
+        have_epoch = get_checkpoint_epochs(seed_folder)
     checkpoints = []
     epochs = []
     for epoch in missing_epochs:
-        checkpoint = f'{seed_folder}/checkpoint{epoch}.pt'
-        if os.path.isfile(checkpoint) or not ready:
-            checkpoints.append(os.path.realpath(checkpoint))
+        if not ready or epoch in have_epoch:
+            checkpoints.append(
+                f'{resolved_seed_folder}/checkpoint{epoch}.pt'
+            )
             epochs.append(epoch)
 
     return checkpoints, target_epochs, missing_epochs
@@ -236,14 +353,10 @@ def check_checkpoint_evaluation(config_env_vars, seed, seed_folder):
     # indication that we deleted a checkpoint too soon
     deleted_checkpoints = False
     if missing_epochs:
-        model_folder = config_env_vars['MODEL_FOLDER']
-        seed_folder = f'{model_folder}seed{seed}'
         earliest_missing_epoch = min(missing_epochs)
+        have_epoch = get_checkpoint_epochs(seed_folder)
         for n in target_epochs:
-            if (
-                n > earliest_missing_epoch
-                and os.path.isfile(f'{seed_folder}/checkpoint{n}.pt')
-            ):
+            if n > earliest_missing_epoch and n in have_epoch:
                 deleted_checkpoints = True
                 break
 
@@ -317,6 +430,10 @@ def print_status(config_env_vars, seed, do_clear=False, warnings=True):
 
     # training/eval ones
     model_folder = config_env_vars['MODEL_FOLDER']
+    max_epoch = int(config_env_vars['MAX_EPOCH'])
+    eval_metric = config_env_vars['EVAL_METRIC']
+    dec_checkpoint = config_env_vars['DECODING_CHECKPOINT']
+    beam_size = config_env_vars['BEAM_SIZE']
     if seed is None:
         seeds = config_env_vars['SEEDS'].split()
     else:
@@ -331,7 +448,6 @@ def print_status(config_env_vars, seed, do_clear=False, warnings=True):
         # default unfinished
         finished[seed] = False
         seed_folder = f'{model_folder}seed{seed}'
-        max_epoch = int(config_env_vars['MAX_EPOCH'])
 
         # find checkpoints with suspiciously smaller sizes
         corrupted_checkpoints.extend(get_corrupted_checkpoints(seed_folder))
@@ -348,15 +464,11 @@ def print_status(config_env_vars, seed, do_clear=False, warnings=True):
         )
 
         # Final model and results
-        dec_checkpoint = config_env_vars['DECODING_CHECKPOINT']
-        beam_size = config_env_vars['BEAM_SIZE']
-        eval_metric = config_env_vars['EVAL_METRIC']
         # valid_checkpoint_wiki.smatch_top5-avg.pt
         dec_final_result = (
-            f'{model_folder}seed{seed}/beam{beam_size}/'
+            f'{seed_folder}/beam{beam_size}/'
             f'valid_{dec_checkpoint}.{eval_metric}'
         )
-        dec_checkpoint = f'{model_folder}seed{seed}/{dec_checkpoint}'
         if os.path.isfile(dec_final_result):
             finished[seed] = True
             status_lines.append(
@@ -366,27 +478,24 @@ def print_status(config_env_vars, seed, do_clear=False, warnings=True):
             status_lines.append((f"pend", f"{dec_final_result}"))
 
     # format lines to avoid overflowing command line size
-    ncol, _ = shutil.get_terminal_size((80, 20))
-    col1_width = max(len_print(x[0]) for x in status_lines) + 2
+    col1_lens = [len_print(col1) for col1, _ in status_lines]
+    col1_width = max(col1_lens) + 2
+    col2_max_width = terminal_ncol - col1_width - 2
     new_statues_lines = []
-    for (col1, col2) in status_lines:
-        delta = col1_width + 2 + len(col2) - ncol
+    for (col1, col2), col1_len in zip(status_lines, col1_lens):
+        delta = len(col2) - col2_max_width
         # correction for scape symbols
-        delta_cl = len(col1) - len_print(col1)
-        if delta_cl > 0:
-            width = col1_width + delta_cl
-        else:
-            width = col1_width
+        width = col1_width + len(col1) - col1_len
 
         if delta > 0:
             half_delta = delta // 2 + 4
             half_col2 = len(col2) // 2
-            col2_crop = col2[:half_col2 - half_delta]
-            col2_crop += ' ... '
-            col2_crop += col2[half_col2 + half_delta:]
-            new_statues_lines.append(f'[{col1:^{width}}] {col2_crop}')
-        else:
-            new_statues_lines.append(f'[{col1:^{width}}] {col2}')
+            col2 = ''.join((
+                col2[:half_col2 - half_delta],
+                ' ... ',
+                col2[half_col2 + half_delta:]
+            ))
+        new_statues_lines.append(f'[{col1:^{width}}] {col2}')
 
     # print
     if do_clear:
@@ -405,21 +514,22 @@ def print_status(config_env_vars, seed, do_clear=False, warnings=True):
 
 def get_score_from_log(file_path, score_name):
 
-    results = [None]
-
     if 'smatch' in score_name:
         regex = smatch_results_re
+        prefix = 'F-score:'
     else:
         raise Exception(f'Unknown score type {score_name}')
 
-    with open(file_path) as fid:
+    with open(file_path, buffering=1 << 16) as fid:
         for line in fid:
-            if regex.match(line):
-                results = regex.match(line).groups()
-                results = [100*float(x) for x in results]
-                break
+            # cheap substring test before running the regex
+            if prefix not in line:
+                continue
+            fetch = regex.match(line)
+            if fetch:
+                return [100*float(x) for x in fetch.groups()]
 
-    return results
+    return [None]
 
 
 def get_best_checkpoints(config_env_vars, seed, target_epochs, n_best=5):
@@ -427,23 +537,28 @@ def get_best_checkpoints(config_env_vars, seed, target_epochs, n_best=5):
     seed_folder = f'{model_folder}seed{seed}'
     validation_folder = f'{seed_folder}/epoch_tests/'
     eval_metric = config_env_vars['EVAL_METRIC']
+    max_epoch = int(config_env_vars['MAX_EPOCH'])
     scores = []
     missing_epochs = []
     rest_checkpoints = []
 
-    for epoch in range(int(config_env_vars['MAX_EPOCH'])):
+    # list folders once instead of probing each epoch's files
+    have_epoch = get_checkpoint_epochs(seed_folder)
+    have_result = set(list_folder(validation_folder))
+
+    for epoch in range(max_epoch):
 
         # store paths of checkpoint that wont need to be evaluated for deletion
         checkpoint_file = f'{seed_folder}/checkpoint{epoch}.pt'
         if epoch not in target_epochs:
-            if os.path.isfile(checkpoint_file):
+            if epoch in have_epoch:
                 rest_checkpoints.append(checkpoint_file)
             else:
                 continue
 
         results_file = \
             f'{validation_folder}/dec-checkpoint{epoch}.{eval_metric}'
-        if not os.path.isfile(results_file):
+        if f'dec-checkpoint{epoch}.{eval_metric}' not in have_result:
             missing_epochs.append(epoch)
             continue
         elif os.stat(results_file).st_size == 0:
@@ -513,39 +628,36 @@ def link_best_model(best_n_checkpoints, config_env_vars, seed, nbest):
             os.symlink(source_best, target_best)
 
 
-def get_average_time_between_write(files):
+def get_average_time_between_write(mtimes):
+    """
+    Average minutes between writes given file modification times. Uses the
+    full elapsed time, gaps over a day are no longer wrapped
+    """
 
-    timestamps = []
-    for dfile in files:
-        timestamps.append((
-            os.path.basename(dfile),
-            datetime.fromtimestamp(os.stat(dfile).st_mtime)
-        ))
-    timestamps = sorted(timestamps, key=lambda x: x[1])
-    deltas = [
-        (x[1] - y[1]).seconds / 60.
-        for x, y in zip(timestamps[1:], timestamps[:-1])
-    ]
-    if len(deltas) < 5:
+    # imported here to keep startup fast for the script usage modes
+    import numpy as np
+
+    mtimes = np.fromiter(mtimes, dtype=np.float64)
+    mtimes.sort()
+    deltas = np.diff(mtimes) / 60.
+    if deltas.size < 5:
         return None
     else:
-        return mean(deltas[2:-2])
+        return float(deltas[2:-2].mean())
 
 
 def get_speed_statistics(seed_folder):
 
-    files = []
-    for checkpoint in glob(f'{seed_folder}/checkpoint*.pt'):
-        if checkpoint_re.match(checkpoint):
-            files.append(checkpoint)
-
-    minutes_per_epoch = get_average_time_between_write(files)
-
-    files = []
-    for checkpoint in glob(f'{seed_folder}/epoch_tests/*.actions'):
-        files.append(checkpoint)
+    # DirEntry.stat() still costs a syscall on POSIX, but avoids the glob
+    minutes_per_epoch = get_average_time_between_write(
+        entry.stat().st_mtime for entry, _ in iter_checkpoints(seed_folder)
+    )
 
-    minutes_per_test = get_average_time_between_write(files)
+    minutes_per_test = get_average_time_between_write(
+        entry.stat().st_mtime
+        for entry in iter_entries(f'{seed_folder}/epoch_tests')
+        if entry.name.endswith('.actions')
+    )
 
     return minutes_per_epoch, minutes_per_test
 
@@ -553,27 +665,38 @@ def get_speed_statistics(seed_folder):
 def average_results(results, fields, average_fields, ignore_fields,
                     concatenate_fields):
 
+    # only needed with --seed-average
+    import numpy as np
+
     # collect
     result_by_seed = defaultdict(list)
     for result in results:
         key = result['model_folder']
         result_by_seed[key].append(result)
 
+    # ignore everything after space
+    fields = [field.split()[0] for field in fields]
+
     # leave only averages
     averaged_results = []
     for seed, sresults in result_by_seed.items():
         average_result = {}
         for field in fields:
-            # ignore everything after space
-            field = field.split()[0]
             if field in average_fields:
-                samples = [r[field] for r in sresults if r[field] is not None]
-                if samples:
-                    average_result[field] = np.mean(samples)
-                    # Add standard deviation
-                    average_result[f'{field}-std'] = np.std(samples)
-                else:
+                # missing values as nan
+                samples = np.fromiter(
+                    (np.nan if r[field] is None else r[field]
+                     for r in sresults),
+                    dtype=np.float64,
+                    count=len(sresults)
+                )
+                if np.isnan(samples).all():
                     average_result[field] = None
+                else:
+                    average_result[field] = float(np.nanmean(samples))
+                    # Add standard deviation
+                    average_result[f'{field}-std'] = \
+                        float(np.nanstd(samples))
 
             elif field in ignore_fields:
                 average_result[field] = ''
@@ -590,11 +713,12 @@ def extract_experiment_data(config_env_vars, seed, do_test):
 
     model_folder = config_env_vars['MODEL_FOLDER']
     seed_folder = f'{model_folder}seed{seed}'
+    max_epoch = int(config_env_vars['MAX_EPOCH'])
+    eval_metric = config_env_vars['EVAL_METRIC']
 
     # Get speed stats
     minutes_per_epoch, minutes_per_test = \
         get_speed_statistics(seed_folder)
-    max_epoch = int(config_env_vars['MAX_EPOCH'])
     if minutes_per_epoch and minutes_per_epoch > 1:
         epoch_time = minutes_per_epoch/60.*max_epoch
     else:
@@ -620,13 +744,11 @@ def extract_experiment_data(config_env_vars, seed, do_test):
     best_checkpoint, best_score = sorted(
         zip(checkpoints, scores), key=lambda x: x[1]
     )[-1]
-    max_epoch = config_env_vars['MAX_EPOCH']
-    best_epoch = checkpoint_re.match(best_checkpoint).groups()[0]
+    best_epoch = get_checkpoint_epoch(best_checkpoint)
 
     # get top-5 beam result
     # TODO: More granularity here. We may want to add many different
     # metrics and sets
-    eval_metric = config_env_vars['EVAL_METRIC']
     sset = 'valid'
     cname = 'checkpoint_wiki.smatch_top5-avg'
     # beam 1
@@ -691,6 +813,31 @@ def extract_experiment_data(config_env_vars, seed, do_test):
     return result
 
 
+def iter_subfolders(folder):
+    # like glob(f'{folder}/*') restricted to folders, without per entry stat
+    for entry in iter_entries(folder):
+        if not entry.name.startswith('.') and entry.is_dir():
+            yield entry
+
+
+def iter_seed_folders(models_folder):
+    """
+    Yield seed folders found under models_folder (may be a glob pattern) at
+    depth three or, for backwards compatibility, depth two
+    """
+    for root in glob(models_folder):
+        for model_entry in iter_subfolders(root):
+            for entry in iter_subfolders(model_entry.path):
+                if seed_re.match(entry.name):
+                    # check for backwars compatibility, depth two foldler
+                    # structure
+                    yield entry.path
+                else:
+                    for seed_entry in iter_subfolders(entry.path):
+                        if seed_re.match(seed_entry.name):
+                            yield seed_entry.path
+
+
 def get_experiment_configs(models_folder, configs, set_seed):
 
     # Collect paths of all experiment folders for different seeds, either by
@@ -700,7 +847,7 @@ def get_experiment_configs(models_folder, configs, set_seed):
 
         # from configs
         for config in configs:
-            config_env_vars = read_config_variables(config)
+            config_env_vars = read_config(config)
             model_folder = config_env_vars['MODEL_FOLDER']
             for seed in config_env_vars['SEEDS'].split():
                 if set_seed and set_seed != seed:
@@ -710,30 +857,18 @@ def get_experiment_configs(models_folder, configs, set_seed):
 
     else:
 
-        model_folders = glob(f'{models_folder}/*/*')
-
         # from DATA folder
-        for model_folder in model_folders:
-
-            # check for backwars compatibility, depth two foldler structure
-            if re.match('.*seed([0-9]+)', model_folder):
-                # set_trace(context=30)
-                seed_folders = [model_folder]
-            else:
-                seed_folders = glob(f'{model_folder}/*')
-
-            for seed_folder in seed_folders:
-                # if config given, identify it by seed
-                if set_seed and f'seed{set_seed}' not in seed_folder:
-                    continue
-                else:
-                    seed = re.match('.*seed([0-9]+)', seed_folder).groups()[0]
-                config = f'{seed_folder}/config.sh'
-                config_env_vars = read_config_variables(config)
-                # if os.path.islink(config):
-                #    config_env_vars['config_path'] = \
-                #        f'configs/{os.path.basename(os.readlink(config))}'
-                config_exps.append((config_env_vars, seed))
+        for seed_folder in iter_seed_folders(models_folder):
+            # if seed given, filter by folder name before reading config
+            seed = seed_re.match(seed_folder).groups()[0]
+            if set_seed and set_seed != seed:
+                continue
+            config = f'{seed_folder}/config.sh'
+            config_env_vars = read_config(config)
+            # if os.path.islink(config):
+            #    config_env_vars['config_path'] = \
+            #        f'configs/{os.path.basename(os.readlink(config))}'
+            config_exps.append((config_env_vars, seed))
 
     return config_exps
 
@@ -816,13 +951,15 @@ def display_results(models_folder, configs, set_seed, seed_average, do_test,
 def len_print(string):
     if string is None:
         return 0
+    elif '\x1b' not in string:
+        # no color, skip regex
+        return len(string)
     else:
-        bash_scape = re.compile(r'\x1b\[\d+m|\x1b\[0m')
-        return len(bash_scape.sub('', string))
+        return len(bash_scape_re.sub('', string))
 
 
-def get_cell_str(row, field, formatter):
-    field2 = field.split()[0]
+def get_cell_str(row, field2, formatter):
+    # field2 is the header field without anything after space
     cell = row[field2]
     if cell is None:
         cell = ''
@@ -841,14 +978,20 @@ def print_table(header, data, formatter, do_clear=False, col0_right=False):
 
     # data structure checks
 
+    # format all cells once
+    fields2 = [field.split()[0] for field in header]
+    formatters = [formatter.get(field, None) for field in header]
+    formatted = [
+        [get_cell_str(row, field2, fmt)
+         for field2, fmt in zip(fields2, formatters)]
+        for row in data
+    ]
+
     # find largest elemend per column
-    max_col_size = []
-    for n, field in enumerate(header):
-        row_lens = [len(field)]
-        for row in data:
-            cell = get_cell_str(row, field, formatter.get(field, None))
-            row_lens.append(len_print(cell))
-        max_col_size.append(max(row_lens))
+    max_col_size = [
+        max([len(field)] + [len_print(row[n]) for row in formatted])
+        for n, field in enumerate(header)
+    ]
 
     # format and print
     if do_clear:
@@ -858,10 +1001,9 @@ def print_table(header, data, formatter, do_clear=False, col0_right=False):
     row_str = ['{:^{width}}'.format(h, width=max_col_size[n])
                for n, h in enumerate(header)]
     print(col_sep.join(row_str))
-    for row in data:
+    for row in formatted:
         row_str = []
-        for n, field in enumerate(header):
-            cell = get_cell_str(row, field, formatter.get(field, None))
+        for n, cell in enumerate(row):
             if col0_right and n == 0:
                 row_str.append(
                     '{:<{width}}'.format(cell, width=max_col_size[n])
@@ -880,6 +1022,11 @@ def ordered_exit(signum, frame):
     exit(1)
 
 
+def update_terminal_size(signum, frame):
+    global terminal_ncol
+    terminal_ncol = shutil.get_terminal_size((80, 20)).columns
+
+
 def link_remove(args, seed, config_env_vars, ignore_missing_checkpoints=False,
                 checkpoints=None, target_epochs=None):
 
@@ -930,78 +1077,157 @@ def link_remove(args, seed, config_env_vars, ignore_missing_checkpoints=False,
             print(missing_epochs)
             print(yellow_font('WARNING: --link-best with missing checkpoints'))
 
-    # remove checkpoints not among the n-best
-    for checkpoint in rest_checkpoints:
-        if os.path.isfile(checkpoint):
-            if not (
-                bool(args.list_checkpoints_ready_to_eval) or
-                bool(args.list_checkpoints_to_eval)
-            ):
-                print(f'rm {checkpoint}')
+    # remove checkpoints not among the n-best. Same checkpoint may be listed
+    # both as not needing evaluation and as scored, keep order
+    for checkpoint in dict.fromkeys(rest_checkpoints):
+        try:
             os.remove(checkpoint)
+        except FileNotFoundError:
+            continue
+        if warnings:
+            print(f'rm {checkpoint}')
+
+
+def watch_experiment_writes(inotify, seed_folders):
+    """
+    (Re)add inotify watches on seed folders and their epoch_tests. Folders
+    not created yet are skipped, re-adding an existing watch is a no-op.
+    Returns False if inotify can not be used
+    """
+    flags = inotify_simple.flags
+    mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+    for seed_folder in seed_folders:
+        for folder in [seed_folder, f'{seed_folder}/epoch_tests']:
+            try:
+                inotify.add_watch(folder, mask)
+            except FileNotFoundError:
+                pass
+            except OSError as exception:
+                # e.g. inotify watch limit reached or no permission
+                print(f'WARNING: inotify failed ({exception}), polling')
+                return False
+    return True
+
+
+def wait_checkpoint_write(inotify, eval_metric, timeout=10):
+    """
+    Block until a checkpoint or {eval_metric} result is written in the
+    watched folders or timeout seconds pass. Without inotify just sleep
+    """
+
+    if inotify is None:
+        sleep(timeout)
+        return
+
+    flags = inotify_simple.flags
+    end_time = time() + timeout
+    while time() < end_time:
+        remaining_ms = max(int((end_time - time()) * 1000), 1)
+        for event in inotify.read(timeout=remaining_ms):
+            if event.mask & flags.CREATE:
+                # only folder creation, files count once written
+                if event.name == 'epoch_tests':
+                    return
+            elif (
+                event.name.startswith('checkpoint')
+                and event.name.endswith('.pt')
+            ) or event.name.endswith(f'.{eval_metric}'):
+                return
 
 
 def wait_checkpoint_ready_to_eval(args):
 
     assert bool(args.config), "Missing config"
 
-    config_env_vars = read_config_variables(args.config)
+    config_env_vars = read_config(args.config)
     if args.seed:
         seeds = [args.seed]
     else:
         seeds = config_env_vars['SEEDS'].split()
+    model_folder = config_env_vars['MODEL_FOLDER']
+    eval_metric = config_env_vars['EVAL_METRIC']
+    seed_folders = [f'{model_folder}seed{seed}' for seed in seeds]
     # eval_init_epoch = int(config_env_vars['EVAL_INIT_EPOCH'])
     # TODO: Clearer naming
-    checkpoints = []
-    need_eval = []
-    while not checkpoints:
-        checkpoints = []
-        need_eval = []
-        for seed in seeds:
-            scheckpoints, starget_epochs, sneed_eval = \
-                get_checkpoints_to_eval(
-                    config_env_vars,
-                    seed,
-                    ready=True,
-                    warnings=False
-                 )
-
-            # sanity check: we did not delete checkpoints without testing them
-            deleted_epochs = [
-                e for e in sneed_eval if e not in starget_epochs
-            ]
-            if deleted_epochs:
-
-                model_folder = config_env_vars['MODEL_FOLDER']
-                seed_folder = f'{model_folder}seed{seed}'
-                print('\nCheckpoints may have been deleted before testing or '
-                      'testing failed on evaluation, missing\n')
-                for epoch in deleted_epochs:
-                    print(f'{seed_folder}/checkpoint{epoch}.pt')
-                exit(1)
-
-            checkpoints.extend(scheckpoints)
-            need_eval.extend(sneed_eval)
+    # one inotify instance for the whole wait, events queue between reads
+    inotify = None
+    if has_inotify:
+        try:
+            inotify = inotify_simple.INotify()
+        except OSError as exception:
+            # e.g. per user instance limit reached
+            print(f'WARNING: inotify failed ({exception}), polling')
+    try:
+        while True:
 
-            # link and/or remove checkpoints
-            if args.link_best or args.remove:
-                link_remove(
-                    args, seed,
-                    config_env_vars, checkpoints=scheckpoints,
-                    target_epochs=starget_epochs,
-                    ignore_missing_checkpoints=args.ignore_missing_checkpoints
-                )
+            # watch before scanning, so writes during the scan are not missed
+            if (
+                inotify is not None
+                and not watch_experiment_writes(inotify, seed_folders)
+            ):
+                inotify.close()
+                inotify = None
+
+            checkpoints = []
+            need_eval = []
+            for seed in seeds:
+                scheckpoints, starget_epochs, sneed_eval = \
+                    get_checkpoints_to_eval(
+                        config_env_vars,
+                        seed,
+                        ready=True,
+                        warnings=False
+                     )
+
+                # sanity check: we did not delete checkpoints without
+                # testing them
+                deleted_epochs = [
+                    e for e in sneed_eval if e not in starget_epochs
+                ]
+                if deleted_epochs:
+
+                    seed_folder = f'{model_folder}seed{seed}'
+                    print('\nCheckpoints may have been deleted before '
+                          'testing or testing failed on evaluation, '
+                          'missing\n')
+                    for epoch in deleted_epochs:
+                        print(f'{seed_folder}/checkpoint{epoch}.pt')
+                    exit(1)
+
+                checkpoints.extend(scheckpoints)
+                need_eval.extend(sneed_eval)
+
+                # link and/or remove checkpoints
+                if args.link_best or args.remove:
+                    link_remove(
+                        args, seed,
+                        config_env_vars, checkpoints=scheckpoints,
+                        target_epochs=starget_epochs,
+                        ignore_missing_checkpoints=(
+                            args.ignore_missing_checkpoints
+                        )
+                    )
 
-        if need_eval == []:
-            print('Finished!')
-            break
+            if need_eval == []:
+                print('Finished!')
+                break
 
-        print_status(config_env_vars, None, do_clear=args.clear)
-        print(
-            f'Waiting for checkpoint to evaluate'
-            ' (if you stop this script, I wont evaluate)'
-        )
-        sleep(10)
+            print_status(config_env_vars, None, do_clear=args.clear)
+            print(
+                f'Waiting for checkpoint to evaluate'
+                ' (if you stop this script, I wont evaluate)'
+            )
+
+            if checkpoints:
+                # a checkpoint may still be being written, give it 10
+                # seconds before returning
+                sleep(10)
+                break
+
+            wait_checkpoint_write(inotify, eval_metric)
+    finally:
+        if inotify is not None:
+            inotify.close()
 
 
 def final_remove(seed, config_env_vars, remove_optimizer=True,
@@ -1042,6 +1268,8 @@ def final_remove(seed, config_env_vars, remove_optimizer=True,
 
     # remove optimizer from final checkpoint
     if remove_optimizer:
+        # imported here, torch is slow to import
+        from fairseq_ext.utils import remove_optimizer_state
         remove_optimizer_state(dec_checkpoint)
 
     # remove all other checkpoints
@@ -1076,6 +1304,9 @@ def remove_corrupted_checkpoints(config, seed, num_models=2):
     Check suspicious size checkpoints plus the last NUM_MODELS
     '''
 
+    # imported here, torch is slow to import
+    from fairseq_ext.utils import load_checkpoint_ext
+
     def remove_if_corrupted(path):
         print(f'\r  load   {path}', flush=True, end='')
         try:
@@ -1095,7 +1326,7 @@ def remove_corrupted_checkpoints(config, seed, num_models=2):
                 raise exception
 
     # print status for this config
-    config_env_vars = read_config_variables(config)
+    config_env_vars = read_config(config)
     if seed:
         seeds = [seed]
     else:
@@ -1154,6 +1385,9 @@ def main(args):
     # set ordered exit
     signal.signal(signal.SIGINT, ordered_exit)
     signal.signal(signal.SIGTERM, ordered_exit)
+    # keep terminal width current on resize
+    if hasattr(signal, 'SIGWINCH'):
+        signal.signal(signal.SIGWINCH, update_terminal_size)
 
     if args.remove_corrupted_checkpoints:
 
@@ -1166,7 +1400,7 @@ def main(args):
         assert args.config, "Needs --config (optional --seed)"
 
         # print status for this config
-        config_env_vars = read_config_variables(args.config)
+        config_env_vars = read_config(args.config)
         if args.seed:
             seeds = [args.seed]
         else:
@@ -1181,7 +1415,7 @@ def main(args):
 
         assert args.config, "Needs config"
 
-        remove_features(read_config_variables(args.config))
+        remove_features(read_config(args.config))
 
     elif args.results or args.long_results:
 
@@ -1203,7 +1437,7 @@ def main(args):
         # List checkpoints that need to be evaluated to complete training. If
         # ready=True list only those checkpoints that exist already
         assert args.seed, "Requires --seed"
-        config_env_vars = read_config_variables(args.config)
+        config_env_vars = read_config(args.config)
         checkpoints, target_epochs, _ = get_checkpoints_to_eval(
             config_env_vars,
             args.seed,
@@ -1227,7 +1461,7 @@ def main(args):
         if args.config is None:
             print('\nSpecify a config with -c or use --results\n')
             exit(1)
-        config_env_vars = read_config_variables(args.config)
+        config_env_vars = read_config(args.config)
 
         if args.seed:
             seeds = [args.seed]